@@ -0,0 +1,51 @@
+"""
+Measures django.setup() time with and without the register app.
+
+    python benchmarks/startup.py [runs]
+
+Every run is a fresh interpreter, so module import costs are included.
+"""
+import os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP_SCRIPT = """
+import sys, time
+from django.conf import settings
+apps = ["django.contrib.auth", "django.contrib.contenttypes",
+        "django.contrib.sessions", "django.contrib.admin"]
+extra = {}
+if sys.argv[1] == "1":
+    apps.append("register")
+    extra["AUTH_USER_MODEL"] = "register.EmailUser"
+settings.configure(
+    INSTALLED_APPS=apps,
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    **extra)
+import django
+start = time.perf_counter()
+django.setup()
+print(time.perf_counter() - start)
+"""
+
+def measure(with_register, runs):
+    timings = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, "-c", SETUP_SCRIPT, "1" if with_register else "0"],
+            cwd=ROOT)
+        timings.append(float(out))
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    without = measure(False, runs)
+    with_register = measure(True, runs)
+    print("django.setup() median over {} runs".format(runs))
+    print("  without register: {:.2f} ms".format(without * 1000))
+    print("  with register:    {:.2f} ms".format(with_register * 1000))
+    print("  difference:       {:.2f} ms".format((with_register - without) * 1000))
+
+if __name__ == "__main__":
+    main()
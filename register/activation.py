@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.cache import cache
+import re
+
+CACHE_PREFIX = "register:activated:"
+STATS_PREFIX = "register:activated-stats:"
+# \Z rather than $, which would also accept a trailing newline
+KEY_RE = re.compile(r"\A[a-fA-F0-9]{64}\Z")
+
+def get_timeout():
+    return getattr(settings, "REGISTER_ACTIVATED_CACHE_TIMEOUT", 60 * 60 * 24)
+
+def remember_activated(key):
+    cache.set(CACHE_PREFIX + key.lower(), True, get_timeout())
+
+def was_activated(key):
+    """
+    Returns True if the key was consumed recently, so repeated clicks on
+    an activation link don't hit the database again.
+    """
+    if not KEY_RE.search(key):
+        return False
+    if cache.get(CACHE_PREFIX + key.lower()):
+        count("hits")
+        return True
+    count("misses")
+    return False
+
+def count(name):
+    key = STATS_PREFIX + name
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+def activation_cache_stats():
+    """
+    Hit and miss counters, shared by every process using the same cache.
+    """
+    return {
+        "hits": cache.get(STATS_PREFIX + "hits", 0),
+        "misses": cache.get(STATS_PREFIX + "misses", 0),
+    }
@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
@@ -42,5 +43,11 @@ class EmailUserAdmin(UserAdmin):
     ordering = ("email",)
     filter_horizontal = ()
 
-admin.site.register(EmailUser, EmailUserAdmin)
-admin.site.unregister(Group)
\ No newline at end of file
+if getattr(settings, "REGISTER_USER_ADMIN", True):
+    admin.site.register(EmailUser, EmailUserAdmin)
+
+if getattr(settings, "REGISTER_HIDE_GROUP_ADMIN", False):
+    try:
+        admin.site.unregister(Group)
+    except admin.sites.NotRegistered:
+        pass
@@ -0,0 +1,33 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+CACHED_BACKEND = "register.backends.CachedStatusBackend"
+
+class RegisterConfig(AppConfig):
+    name = "register"
+    verbose_name = "Register"
+
+    def ready(self):
+        from .models import EmailUser, send_confirmation_email
+        senders = [EmailUser]
+        cached = CACHED_BACKEND in getattr(settings, "AUTHENTICATION_BACKENDS", ())
+        if cached:
+            from .backends import cached_user_class
+            # saving a cached user sends its deferred class as sender
+            senders.append(cached_user_class(EmailUser))
+        for sender in senders:
+            post_save.connect(
+                send_confirmation_email,
+                sender=sender,
+                dispatch_uid="register.send_confirmation_email." + sender.__name__)
+            if cached:
+                from .backends import invalidate_user_status
+                post_save.connect(
+                    invalidate_user_status,
+                    sender=sender,
+                    dispatch_uid="register.invalidate_user_status.save." + sender.__name__)
+                post_delete.connect(
+                    invalidate_user_status,
+                    sender=sender,
+                    dispatch_uid="register.invalidate_user_status.delete." + sender.__name__)
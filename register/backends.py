@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db import router, transaction
+from django.db.models.query_utils import deferred_class_factory
+
+CACHE_PREFIX = "register:status:"
+STATUS_FIELDS = ("email", "full_name", "is_active", "is_staff", "is_superuser")
+
+def get_timeout():
+    return getattr(settings, "REGISTER_USER_STATUS_CACHE_TIMEOUT", 60 * 60)
+
+def user_status(user):
+    status = dict((name, getattr(user, name)) for name in STATUS_FIELDS)
+    status["pk"] = user.pk
+    status["fingerprint"] = user.get_session_auth_hash()
+    return status
+
+def cache_user_status(user):
+    cache.set(CACHE_PREFIX + str(user.pk), user_status(user), get_timeout())
+
+def invalidate_user_status(sender, instance, using=None, **kwargs):
+    key = CACHE_PREFIX + str(instance.pk)
+    cache.delete(key)
+    # a request reading the old row before commit could cache it again
+    transaction.on_commit(lambda: cache.delete(key), using=using)
+
+def cached_user_class(user_model):
+    """
+    The deferred class of users built by user_from_status(). Django registers
+    it once, so the same class is returned on every call.
+    """
+    deferred = [f.attname for f in user_model._meta.concrete_fields
+                if f.attname not in STATUS_FIELDS and not f.primary_key]
+    return deferred_class_factory(user_model, deferred)
+
+def user_from_status(user_model, status):
+    """
+    Builds a user from a cached status record. Fields missing from the
+    record are deferred, so they are loaded from the database on access
+    and save() updates only the loaded fields.
+    """
+    user = cached_user_class(user_model)(pk=status["pk"], **dict((name, status[name]) for name in STATUS_FIELDS))
+    user._state.adding = False
+    user._state.db = router.db_for_read(user_model)
+    user._password_fingerprint = status["fingerprint"]
+    return user
+
+class CachedStatusBackend(ModelBackend):
+    """
+    Serves get_user() from a compact status record kept in the cache,
+    so authenticated requests don't load the full user row.
+    """
+    def get_user(self, user_id):
+        user_model = get_user_model()
+        status = cache.get(CACHE_PREFIX + str(user_id))
+        if status is not None:
+            return user_from_status(user_model, status)
+        try:
+            user = user_model._default_manager.get(pk=user_id)
+        except user_model.DoesNotExist:
+            return None
+        cache_user_status(user)
+        return user
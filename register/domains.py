@@ -0,0 +1,97 @@
+from django.conf import settings
+import os, threading, logging
+
+logger = logging.getLogger(__name__)
+
+WILDCARD_PREFIX = "*."
+
+class DomainList:
+    """
+    A set of email domains loaded from a text file, one domain per line.
+    Lines starting with "#" are ignored. An entry like "*.example.com"
+    matches every subdomain of example.com (but not example.com itself).
+    The file is reloaded as soon as its modification time, size or inode
+    changes; if it can't be read, the last loaded domains stay in use.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.missing = False
+        self.domains = (frozenset(), frozenset())
+        self.lock = threading.Lock()
+
+    def load(self):
+        exact, wildcards = set(), set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                domain = line.split("#", 1)[0].strip().lower().rstrip(".")
+                if not domain:
+                    continue
+                if domain.startswith(WILDCARD_PREFIX):
+                    wildcards.add(domain[len(WILDCARD_PREFIX):])
+                else:
+                    exact.add(domain)
+        return (frozenset(exact), frozenset(wildcards))
+
+    def refresh(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            if not self.missing:
+                self.missing = True
+                logger.warning("Domain list %s not found", self.path)
+            return
+        self.missing = False
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature != self.signature:
+                try:
+                    self.domains = self.load()
+                except (OSError, ValueError) as e:
+                    logger.warning("Can't load domain list %s: %s", self.path, e)
+                self.signature = signature
+
+    def __contains__(self, domain):
+        self.refresh()
+        domain = domain.lower().rstrip(".")
+        exact, wildcards = self.domains
+        if domain in exact:
+            return True
+        if not wildcards:
+            return False
+        # walk parent domains: a.b.example.com -> b.example.com -> example.com -> com
+        pos = domain.find(".")
+        while pos != -1:
+            parent = domain[pos + 1:]
+            if parent in wildcards:
+                return True
+            pos = domain.find(".", pos + 1)
+        return False
+
+_lists = {}
+
+def get_domain_list(path):
+    if not path:
+        return None
+    domains = _lists.get(path)
+    if domains is None:
+        domains = _lists.setdefault(path, DomainList(path))
+    return domains
+
+def domain_allowed(email):
+    """
+    Checks an email's domain against REGISTER_BLOCKED_DOMAINS_FILE.
+    Domains listed in REGISTER_ALLOWED_DOMAINS_FILE are never blocked.
+    """
+    blocked = get_domain_list(getattr(settings, "REGISTER_BLOCKED_DOMAINS_FILE", None))
+    if blocked is None:
+        return True
+    domain = email.rpartition("@")[2]
+    if not domain:
+        return True
+    allowed = get_domain_list(getattr(settings, "REGISTER_ALLOWED_DOMAINS_FILE", None))
+    if allowed is not None and domain in allowed:
+        return True
+    return domain not in blocked
@@ -1,7 +1,8 @@
 from django import forms
 from django.utils.translation import ugettext as _
 from .models import EmailUser
-import re
+from .domains import domain_allowed
+from .activation import KEY_RE
 
 class EmailUserForm(forms.ModelForm):
     password1 = forms.CharField(
@@ -19,6 +20,12 @@ class EmailUserForm(forms.ModelForm):
         model = EmailUser
         fields = ["email", "full_name"]
 
+    def clean_email(self):
+        email = self.cleaned_data["email"]
+        if not domain_allowed(email):
+            raise forms.ValidationError(_("Registration from this email domain is not allowed"))
+        return email
+
     def clean(self):
         cleaned_data = super(EmailUserForm, self).clean()
         p1 = cleaned_data.get("password1", "")
@@ -41,7 +48,7 @@ class ActivateUserForm(forms.Form):
 
     def clean_activation_key(self):
         k = self.cleaned_data["activation_key"]
-        if not re.match("^[a-fA-F0-9]{64}$", k):
+        if not KEY_RE.search(k):
             raise forms.ValidationError(_("Activation code has wrong format"))
         return k
 
@@ -0,0 +1,171 @@
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template import Context, loader
+from django.utils.translation import ugettext as _
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+import multiprocessing, smtplib, threading, time
+
+def activation_email(user):
+    msg_template = loader.get_template("register/activation_email.txt")
+    ctx = Context({"activation_key": user.activation_key})
+    subject = getattr(settings, "REGISTER_ACTIVATION_SUBJECT", _("Activation code"))
+    from_email = getattr(settings, "REGISTER_FROM_EMAIL", "noreply@example.com")
+    return EmailMessage(subject, msg_template.render(ctx), from_email, [user.email])
+
+def group_by_domain(messages):
+    groups = OrderedDict()
+    for msg in messages:
+        domain = msg.to[0].rpartition("@")[2].lower() if msg.to else ""
+        groups.setdefault(domain, []).append(msg)
+    return groups
+
+class RateLimiter:
+    """
+    Spaces calls to wait() at least 1/rate seconds apart across threads.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_send = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            send_at = max(self.next_send, now)
+            self.next_send = send_at + self.interval
+        if send_at > now:
+            time.sleep(send_at - now)
+
+def send_message(connection, msg):
+    try:
+        return bool(connection.send_messages([msg]))
+    except (smtplib.SMTPException, OSError):
+        return False
+
+def send_over_connection(queue, limiter, retries, results):
+    """
+    Sends queued messages over one persistent connection. A failed send
+    reconnects and retries the message up to `retries` times, so a server
+    dropping the connection doesn't lose the rest of the queue.
+    """
+    sent = failed = 0
+    connection = get_connection(fail_silently=True)
+    connection.open()
+    try:
+        while True:
+            try:
+                msg = queue.popleft()
+            except IndexError:
+                break
+            for attempt in range(retries + 1):
+                if attempt:
+                    connection.close()
+                    connection.open()
+                limiter.wait()
+                if send_message(connection, msg):
+                    sent += 1
+                    break
+            else:
+                failed += 1
+    finally:
+        connection.close()
+    results.append((sent, failed))
+
+def send_domain(batch):
+    """
+    Sends one domain's messages over `connections` persistent connections
+    running in parallel, at most `rate` messages per second in total.
+    """
+    messages, connections, rate, retries = batch
+    queue = deque(messages)
+    limiter = RateLimiter(rate)
+    results = []
+    threads = [threading.Thread(target=send_over_connection, args=(queue, limiter, retries, results))
+               for _ in range(connections - 1)]
+    for thread in threads:
+        thread.start()
+    send_over_connection(queue, limiter, retries, results)
+    for thread in threads:
+        thread.join()
+    return (sum(r[0] for r in results), sum(r[1] for r in results))
+
+def send_domains(task):
+    """
+    Sends several domains at once, so a rate limited domain doesn't hold
+    back the others.
+    """
+    batches, threads = task
+    pool = ThreadPool(min(threads, len(batches)))
+    try:
+        results = pool.map(send_domain, batches)
+    finally:
+        pool.close()
+        pool.join()
+    return (sum(r[0] for r in results), sum(r[1] for r in results))
+
+def init_worker():
+    import django
+    django.setup()
+
+class MailDispatcher:
+    """
+    Sends a bulk of messages grouped by recipient domain. Every domain gets
+    up to `connections_per_domain` persistent connections, and `rate_per_domain`
+    caps messages per second for each domain. Domains are spread across
+    `processes` worker processes, each sending up to `domains_per_process`
+    domains at once. A failed message is retried up to `retries` times over
+    a new connection.
+    """
+    def __init__(self, processes=None, connections_per_domain=None, rate_per_domain=None,
+                 domains_per_process=None, retries=None):
+        if processes is None:
+            processes = getattr(settings, "REGISTER_MAIL_PROCESSES", 1)
+        if connections_per_domain is None:
+            connections_per_domain = getattr(settings, "REGISTER_MAIL_CONNECTIONS_PER_DOMAIN", 1)
+        if rate_per_domain is None:
+            rate_per_domain = getattr(settings, "REGISTER_MAIL_RATE_PER_DOMAIN", None)
+        if domains_per_process is None:
+            domains_per_process = getattr(settings, "REGISTER_MAIL_DOMAINS_PER_PROCESS", 10)
+        if retries is None:
+            retries = getattr(settings, "REGISTER_MAIL_RETRIES", 2)
+        self.processes = max(1, processes)
+        self.connections_per_domain = max(1, connections_per_domain)
+        self.rate_per_domain = rate_per_domain
+        self.domains_per_process = max(1, domains_per_process)
+        self.retries = max(0, retries)
+
+    def batches(self, messages):
+        for domain, msgs in group_by_domain(messages).items():
+            yield (msgs, min(self.connections_per_domain, len(msgs)), self.rate_per_domain, self.retries)
+
+    def send(self, messages):
+        messages = list(messages)
+        start = time.monotonic()
+        batches = list(self.batches(messages))
+        processes = min(self.processes, len(batches))
+        tasks = [(batches[i::processes], self.domains_per_process) for i in range(processes)]
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, initializer=init_worker)
+            try:
+                results = pool.map(send_domains, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = list(map(send_domains, tasks))
+        elapsed = time.monotonic() - start
+        sent = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        return {
+            "sent": sent,
+            "failed": failed,
+            "unsent": len(messages) - sent - failed,
+            "elapsed": elapsed,
+            "per_second": sent / elapsed if elapsed else 0.0,
+        }
+
+def send_activation_emails(users, **kwargs):
+    return MailDispatcher(**kwargs).send([activation_email(user) for user in users])
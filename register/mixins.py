@@ -3,6 +3,7 @@ from django.shortcuts import redirect
 from django.contrib.auth import get_user_model
 from django.http import HttpResponseRedirect
 from .signals import user_activated
+from .activation import was_activated
 
 class UserEmailMixin:
     def form_valid(self, form):
@@ -12,6 +13,8 @@ class UserEmailMixin:
 class ActivateMixin:
     def render_result(self, ctx):
         key = ctx.get("activation_key", "")
+        if was_activated(key):
+            return redirect(reverse("activation_complete"))
         user = self.activate(key)
         if not user:
             return redirect(reverse("activation_error"))
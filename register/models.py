@@ -1,13 +1,9 @@
 from django.db import models
-from django.conf import settings
-from django.dispatch import receiver
-from django.template import Context, loader
-from django.core.mail import send_mail
 from django.utils.translation import ugettext as _
-from django.db.models.signals import post_save
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-import os, sys, hashlib, binascii, re
+import os, sys, hashlib, binascii
 from .signals import user_registered
+from .activation import KEY_RE, remember_activated
 
 DEFAULT_KEY = "USER_ACTIVATED"
 PY34 = (sys.version_info >= (3,4))
@@ -36,8 +32,7 @@ class EmailUserManager(BaseUserManager):
         return user
 
     def activate(self, key):
-        key_search_re = re.compile("^[a-fA-F0-9]{64}$")
-        if key_search_re.search(key):
+        if KEY_RE.search(key):
             try:
                 user = self.get(activation_key=key)
             except self.model.DoesNotExist:
@@ -45,6 +40,7 @@ class EmailUserManager(BaseUserManager):
             user.is_active = True
             user.activation_key = DEFAULT_KEY
             user.save()
+            remember_activated(key)
             return user
         return False
 
@@ -70,10 +66,16 @@ class EmailUser(AbstractBaseUser):
         return self.email
 
     def has_perm(self, perm, obj=None):
-        return True
+        return self.is_active and (self.is_staff or self.is_superuser)
 
     def has_module_perms(self, app_label):
-        return True
+        return self.is_active and (self.is_staff or self.is_superuser)
+
+    def get_session_auth_hash(self):
+        # a cached user carries the hash while its password isn't loaded
+        if "password" not in self.__dict__ and "_password_fingerprint" in self.__dict__:
+            return self._password_fingerprint
+        return super(EmailUser, self).get_session_auth_hash()
 
     def gen_activation_key(self):
         salt = os.urandom(16)
@@ -89,20 +91,9 @@ class EmailUser(AbstractBaseUser):
             key = hashlib.sha256(bytes(s, "utf-8")).hexdigest()
         return key
 
-@receiver(post_save, sender=EmailUser)
 def send_confirmation_email(sender, **kwargs):
+    from .mail import activation_email
     user = kwargs["instance"]
-    recpt = user.email
-    activation_key = user.activation_key
-    msg_template = loader.get_template("register/activation_email.txt")
-    ctx = Context({"activation_key": activation_key})
-    msg_body = msg_template.render(ctx)
-    subject = getattr(settings, "REGISTER_ACTIVATION_SUBJECT", _("Activation code"))
-    from_email = getattr(settings, "REGISTER_FROM_EMAIL", "noreply@example.com")
+    msg = activation_email(user)
     user_registered.send(sender=EmailUser, user=user)
-    send_mail(
-        subject,
-        msg_body,
-        from_email,
-        [recpt],
-        fail_silently=True)
+    msg.send(fail_silently=True)
@@ -1,17 +1,32 @@
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from django.core import mail
+from django.core.cache import cache
 from django.db import IntegrityError
 from django.forms import ValidationError
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth import get_user_model
-from register.models import EmailUser, DEFAULT_KEY
+from register.models import EmailUser, DEFAULT_KEY, send_confirmation_email
 from register.forms import EmailUserForm, ActivateUserForm
 from register.mixins import ActivateMixin
 from register.views import ActivateUserView
 from register.signals import user_registered, user_activated
-import re
+from register.domains import DomainList
+from register.activation import KEY_RE, activation_cache_stats
+from register.mail import MailDispatcher, send_activation_emails
+from register.backends import CachedStatusBackend, cached_user_class, cache_user_status, invalidate_user_status
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+import re, os, shutil, socket, tempfile, threading, time
 
 class EmailUserModelTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_user_not_active_by_default(self):
         user = EmailUser.objects.create_user("mail@example.com")
         self.assertFalse(user.is_active)
@@ -209,6 +224,84 @@ class EmailUserFormTest(TestCase):
         user = f.save()
         self.assertEqual(str(user), "user@mail.com")
 
+class DomainPolicyTest(TestCase):
+    def write_list(self, *domains):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(domains))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def rewrite(self, path, content):
+        # keep the mtime, as an mtime-preserving copy or a fast rewrite would
+        st = os.stat(path)
+        with open(path, "wb") as f:
+            f.write(content)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def form_data(self, email):
+        return {
+        "email": email,
+        "full_name": "full name",
+        "password1": "secret",
+        "password2": "secret",
+        }
+
+    def test_domain_list_exact_and_wildcard(self):
+        domains = DomainList(self.write_list("# comment", "spam.com", "*.trash.org"))
+        self.assertIn("spam.com", domains)
+        self.assertIn("SPAM.com", domains)
+        self.assertNotIn("sub.spam.com", domains)
+        self.assertIn("a.b.trash.org", domains)
+        self.assertNotIn("trash.org", domains)
+        self.assertNotIn("mail.com", domains)
+
+    def test_domain_list_reloads_on_change(self):
+        path = self.write_list("spam.com")
+        domains = DomainList(path)
+        self.assertIn("spam.com", domains)
+        self.rewrite(path, b"other.com")
+        self.assertNotIn("spam.com", domains)
+        self.assertIn("other.com", domains)
+
+    def test_domain_list_reloads_on_replace(self):
+        path = self.write_list("spam.com")
+        domains = DomainList(path)
+        self.assertIn("spam.com", domains)
+        st = os.stat(path)
+        replacement = path + ".new"
+        with open(replacement, "w") as f:
+            f.write("spam.org")
+        os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(replacement, path)
+        self.assertNotIn("spam.com", domains)
+        self.assertIn("spam.org", domains)
+
+    def test_domain_list_keeps_last_good_domains(self):
+        path = self.write_list("spam.com")
+        domains = DomainList(path)
+        self.assertIn("spam.com", domains)
+        self.rewrite(path, b"other.com\n\xff\xfe")
+        self.assertIn("spam.com", domains)
+        self.assertNotIn("other.com", domains)
+
+    def test_domain_list_missing_file(self):
+        domains = DomainList(os.path.join(tempfile.gettempdir(), "no-such-domain-list"))
+        self.assertNotIn("spam.com", domains)
+
+    def test_form_blocked_domain(self):
+        with override_settings(REGISTER_BLOCKED_DOMAINS_FILE=self.write_list("*.trash.org")):
+            f = EmailUserForm(self.form_data("user@x.trash.org"))
+            self.assertFalse(f.is_valid())
+            self.assertIn("email", f.errors)
+
+    def test_form_allowed_domain_overrides_blocked(self):
+        with override_settings(
+                REGISTER_BLOCKED_DOMAINS_FILE=self.write_list("*.trash.org"),
+                REGISTER_ALLOWED_DOMAINS_FILE=self.write_list("ok.trash.org")):
+            f = EmailUserForm(self.form_data("user@ok.trash.org"))
+            self.assertTrue(f.is_valid())
+
 class ActivateUserFormTest(TestCase):
     def test_form_key_is_required(self):
         f = ActivateUserForm()
@@ -229,6 +322,10 @@ class ActivateUserFormTest(TestCase):
         f = ActivateUserForm(data)
         self.assertFalse(f.is_valid())
 
+    def test_key_with_trailing_newline(self):
+        self.assertTrue(KEY_RE.search("a1"*32))
+        self.assertFalse(KEY_RE.search("a1"*32 + "\n"))
+
     def test_form_is_valid(self):
         user = EmailUser()
         data = {"activation_key": user.gen_activation_key()}
@@ -238,6 +335,9 @@ class ActivateUserFormTest(TestCase):
 class RegisterViewsTest(TestCase):
     urls = "register.urls"
 
+    def setUp(self):
+        cache.clear()
+
     def setup_view(self, view, request, *args, **kwargs):
         view.request = request
         view.args = args
@@ -412,6 +512,9 @@ class RegisterViewsTest(TestCase):
         self.assertContains(response, "Activation complete")
 
 class SignalTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_user_registered_signal(self):
         def handler(sender, user, **kwargs):
             self.user = user
@@ -455,4 +558,358 @@ class SignalTest(TestCase):
         self.assertEqual(self.user.email, "user@mail.com")
         self.assertEqual(self.user.full_name, "user name")
         self.assertTrue(self.user.check_password("secret"))
-        self.assertEqual(self.user.activation_key, DEFAULT_KEY)
\ No newline at end of file
+        self.assertEqual(self.user.activation_key, DEFAULT_KEY)
+
+class ActivationCacheTest(TestCase):
+    urls = "register.tests.urls"
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_activation_shows_complete_message(self):
+        EmailUser.objects.create_user("mail@example.com", activation_key="2"*64)
+        url = "{}?activation_key={}".format(reverse("activate_user"), "2"*64)
+        self.client.get(url, follow=True)
+        response = self.client.get(url, follow=True)
+        self.assertContains(response, "Activation complete")
+
+    def test_repeated_activation_skips_database(self):
+        EmailUser.objects.create_user("mail@example.com", activation_key="3"*64)
+        EmailUser.objects.activate("3"*64)
+        view = ActivateUserView()
+        with self.assertNumQueries(0):
+            response = view.render_result({"activation_key": "3"*64})
+        self.assertEqual(response["Location"], reverse("activation_complete"))
+        self.assertEqual(activation_cache_stats()["hits"], 1)
+
+    def test_key_with_trailing_newline(self):
+        url = "{}?activation_key={}%0A".format(reverse("activate_user"), "7"*64)
+        response = self.client.get(url)
+        self.assertTrue(response["Location"].endswith(reverse("activation_error")))
+        # the key never reaches the cache
+        self.assertEqual(activation_cache_stats()["misses"], 0)
+
+    def test_unknown_key_counts_miss(self):
+        view = ActivateUserView()
+        response = view.render_result({"activation_key": "4"*64})
+        self.assertEqual(response["Location"], reverse("activation_error"))
+        self.assertEqual(activation_cache_stats()["misses"], 1)
+
+class SMTPSink:
+    """
+    A minimal SMTP server running in a thread. It drops a connection after
+    `max_per_connection` messages and refuses recipients containing "reject".
+    """
+    def __init__(self, max_per_connection=None):
+        self.max_per_connection = max_per_connection
+        self.connections = 0
+        self.recipients = []
+        self.lock = threading.Lock()
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.connections += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        f = conn.makefile("rb")
+        reply = lambda line: conn.sendall(line.encode("ascii") + b"\r\n")
+        reply("220 sink")
+        received, rcpt = 0, []
+        try:
+            for line in f:
+                cmd = line.decode("ascii", "replace").strip()
+                verb = cmd[:4].upper()
+                if verb in ("EHLO", "HELO"):
+                    reply("250 sink")
+                elif verb == "MAIL":
+                    rcpt = []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    if "reject" in cmd:
+                        reply("550 No such user")
+                    else:
+                        rcpt.append(cmd.split(":", 1)[1].strip(" <>"))
+                        reply("250 OK")
+                elif verb == "DATA":
+                    reply("354 Go ahead")
+                    for data in f:
+                        if data in (b".\r\n", b".\n"):
+                            break
+                    with self.lock:
+                        self.recipients.extend(rcpt)
+                    received += 1
+                    reply("250 OK")
+                    if self.max_per_connection and received >= self.max_per_connection:
+                        break
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    reply("250 OK")
+        except OSError:
+            pass
+        finally:
+            f.close()
+            conn.close()
+
+class CountingBackend(LocmemBackend):
+    opened = []
+
+    def open(self):
+        self.sent = 0
+        CountingBackend.opened.append(self)
+        return True
+
+    def send_messages(self, messages):
+        self.sent += len(messages)
+        return super(CountingBackend, self).send_messages(messages)
+
+class MailDispatcherTest(TestCase):
+    def setUp(self):
+        CountingBackend.opened = []
+
+    def messages(self, *recipients):
+        return [EmailMessage("subject", "body", "noreply@example.com", [r]) for r in recipients]
+
+    def test_batches_grouped_by_domain(self):
+        dispatcher = MailDispatcher(connections_per_domain=2)
+        msgs = self.messages("a@one.com", "b@two.com", "c@one.com", "d@ONE.com")
+        batches = list(dispatcher.batches(msgs))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual([m.to[0] for m in batches[0][0]], ["a@one.com", "c@one.com", "d@ONE.com"])
+        self.assertEqual(batches[0][1], 2)
+        self.assertEqual(batches[1][1], 1)
+
+    def test_send_reports_stats(self):
+        result = MailDispatcher().send(self.messages("a@one.com", "b@two.com"))
+        self.assertEqual(result["sent"], 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("per_second", result)
+
+    @override_settings(EMAIL_BACKEND="register.tests.tests.CountingBackend")
+    def test_connection_reused_per_domain(self):
+        MailDispatcher().send(self.messages("a@one.com", "b@one.com", "c@one.com", "d@two.com"))
+        self.assertEqual(sorted(c.sent for c in CountingBackend.opened), [1, 3])
+
+    @override_settings(EMAIL_BACKEND="register.tests.tests.CountingBackend")
+    def test_connections_per_domain(self):
+        MailDispatcher(connections_per_domain=3).send(self.messages("a@one.com", "b@one.com"))
+        self.assertEqual(len(CountingBackend.opened), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_rate_per_domain(self):
+        result = MailDispatcher(rate_per_domain=50).send(
+            self.messages("a@one.com", "b@one.com", "c@one.com"))
+        self.assertGreaterEqual(result["elapsed"], 2.0 / 50)
+
+    def test_rate_per_domain_shared_by_connections(self):
+        result = MailDispatcher(connections_per_domain=2, rate_per_domain=50).send(
+            self.messages(*["{}@one.com".format(i) for i in range(6)]))
+        self.assertGreaterEqual(result["elapsed"], 5.0 / 50)
+
+    def test_send_in_processes(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.filebased.EmailBackend",
+                EMAIL_FILE_PATH=path):
+            result = MailDispatcher(processes=2).send(
+                self.messages("a@one.com", "b@two.com", "c@two.com"))
+        self.assertEqual(result["sent"], 3)
+        content = "".join(open(os.path.join(path, name)).read() for name in os.listdir(path))
+        for recipient in ("a@one.com", "b@two.com", "c@two.com"):
+            self.assertIn("To: " + recipient, content)
+
+    def smtp_settings(self, sink):
+        return override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=sink.port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False)
+
+    def test_smtp_connection_reused(self):
+        sink = SMTPSink()
+        self.addCleanup(sink.close)
+        with self.smtp_settings(sink):
+            result = MailDispatcher().send(
+                self.messages("a@one.com", "b@one.com", "c@one.com", "d@two.com"))
+        self.assertEqual(result["sent"], 4)
+        self.assertEqual(sink.connections, 2)
+        self.assertEqual(sorted(sink.recipients), ["a@one.com", "b@one.com", "c@one.com", "d@two.com"])
+
+    def test_smtp_reconnect_after_disconnect(self):
+        sink = SMTPSink(max_per_connection=2)
+        self.addCleanup(sink.close)
+        with self.smtp_settings(sink):
+            result = MailDispatcher().send(
+                self.messages(*["{}@one.com".format(i) for i in range(6)]))
+        self.assertEqual((result["sent"], result["failed"], result["unsent"]), (6, 0, 0))
+        self.assertEqual(len(sink.recipients), 6)
+        self.assertEqual(sink.connections, 3)
+
+    def test_smtp_failed_messages_reported(self):
+        sink = SMTPSink()
+        self.addCleanup(sink.close)
+        with self.smtp_settings(sink):
+            result = MailDispatcher(retries=1).send(
+                self.messages("a@one.com", "reject@one.com", "b@one.com"))
+        self.assertEqual((result["sent"], result["failed"], result["unsent"]), (2, 1, 0))
+        self.assertEqual(sorted(sink.recipients), ["a@one.com", "b@one.com"])
+
+    def test_rate_limited_domain_does_not_block_others(self):
+        sink = SMTPSink()
+        self.addCleanup(sink.close)
+        msgs = self.messages(*["{}@slow.com".format(i) for i in range(6)])
+        msgs.append(self.messages("a@fast.com")[0])
+        with self.smtp_settings(sink):
+            dispatcher = MailDispatcher(rate_per_domain=10)
+            thread = threading.Thread(target=dispatcher.send, args=(msgs,))
+            thread.start()
+            deadline = time.monotonic() + 5
+            while "a@fast.com" not in sink.recipients and time.monotonic() < deadline:
+                time.sleep(0.01)
+            slow_sent = len([r for r in sink.recipients if r.endswith("@slow.com")])
+            thread.join()
+        self.assertIn("a@fast.com", sink.recipients)
+        self.assertLess(slow_sent, 6)
+
+    def test_send_activation_emails(self):
+        user = EmailUser.objects.create_user("mail@example.com", activation_key="5"*64)
+        mail.outbox = []
+        send_activation_emails([user])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, "Activation code")
+        self.assertIn("5"*64, mail.outbox[0].body)
+
+def connect_cached_backend(testcase):
+    with override_settings(AUTHENTICATION_BACKENDS=["register.backends.CachedStatusBackend"]):
+        apps.get_app_config("register").ready()
+    def disconnect():
+        for sender in (EmailUser, cached_user_class(EmailUser)):
+            for signal, kind in ((post_save, "save"), (post_delete, "delete")):
+                signal.disconnect(
+                    sender=sender,
+                    dispatch_uid="register.invalidate_user_status.{}.{}".format(kind, sender.__name__))
+        post_save.disconnect(
+            sender=cached_user_class(EmailUser),
+            dispatch_uid="register.send_confirmation_email." + cached_user_class(EmailUser).__name__)
+    testcase.addCleanup(disconnect)
+
+class CachedStatusBackendTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        connect_cached_backend(self)
+        self.user = EmailUser.objects.create_user(
+            "mail@example.com", password="secret", full_name="New User", is_active=True)
+
+    def test_get_user_from_cache_skips_database(self):
+        backend = CachedStatusBackend()
+        backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = backend.get_user(self.user.pk)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.email, "mail@example.com")
+            self.assertEqual(user.get_full_name(), "New User")
+            self.assertTrue(user.is_active)
+            self.assertEqual(user.get_session_auth_hash(), self.user.get_session_auth_hash())
+
+    def test_cached_user_loads_other_fields_on_access(self):
+        backend = CachedStatusBackend()
+        backend.get_user(self.user.pk)
+        user = backend.get_user(self.user.pk)
+        self.assertTrue(user.check_password("secret"))
+
+    def test_save_invalidates_cache(self):
+        backend = CachedStatusBackend()
+        backend.get_user(self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(backend.get_user(self.user.pk).is_active)
+
+    def test_missing_user(self):
+        self.assertIsNone(CachedStatusBackend().get_user(self.user.pk + 1))
+
+    def test_password_change_updates_session_hash(self):
+        backend = CachedStatusBackend()
+        backend.get_user(self.user.pk)
+        user = backend.get_user(self.user.pk)
+        user.set_password("new")
+        user.save()
+        fresh = EmailUser.objects.get(pk=self.user.pk)
+        self.assertEqual(user.get_session_auth_hash(), fresh.get_session_auth_hash())
+        self.assertEqual(backend.get_user(self.user.pk).get_session_auth_hash(), fresh.get_session_auth_hash())
+
+    def test_save_updates_only_loaded_fields(self):
+        backend = CachedStatusBackend()
+        backend.get_user(self.user.pk)
+        user = backend.get_user(self.user.pk)
+        EmailUser.objects.filter(pk=self.user.pk).update(activation_key="6"*64)
+        user.full_name = "Other Name"
+        with CaptureQueriesContext(connection) as ctx:
+            user.save()
+        # the UPDATE and the confirmation email reading activation_key
+        self.assertEqual(len(ctx.captured_queries), 2)
+        update = [q["sql"] for q in ctx.captured_queries if "UPDATE" in q["sql"]]
+        self.assertEqual(len(update), 1)
+        self.assertNotIn("password", update[0])
+        fresh = EmailUser.objects.get(pk=self.user.pk)
+        self.assertEqual(fresh.full_name, "Other Name")
+        self.assertEqual(fresh.activation_key, "6"*64)
+        self.assertTrue(fresh.check_password("secret"))
+
+    def test_save_cached_user_sends_mail(self):
+        backend = CachedStatusBackend()
+        backend.get_user(self.user.pk)
+        user = backend.get_user(self.user.pk)
+        mail.outbox = []
+        user.save()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_permissions(self):
+        su = EmailUser.objects.create_superuser("supermail@example.com", "secret")
+        self.assertTrue(su.has_perm("register.change_emailuser"))
+        self.assertTrue(su.has_module_perms("register"))
+        staff = EmailUser.objects.create_user("staff@example.com", is_active=True, is_staff=True)
+        self.assertTrue(staff.has_perm("register.change_emailuser"))
+        self.assertTrue(staff.has_module_perms("register"))
+        self.assertFalse(self.user.has_perm("register.change_emailuser"))
+        self.assertFalse(self.user.has_module_perms("register"))
+
+    def test_receivers_ignore_other_models(self):
+        receivers = post_save._live_receivers(ContentType)
+        self.assertNotIn(invalidate_user_status, receivers)
+        self.assertNotIn(send_confirmation_email, receivers)
+
+class CachedStatusCommitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        connect_cached_backend(self)
+
+    def test_invalidated_again_after_commit(self):
+        user = EmailUser.objects.create_user(
+            "mail@example.com", password="secret", is_active=True, is_staff=True)
+        backend = CachedStatusBackend()
+        with transaction.atomic():
+            stale = EmailUser.objects.get(pk=user.pk)
+            user.is_staff = False
+            user.save()
+            # another request reloading the row before commit
+            cache_user_status(stale)
+        self.assertFalse(backend.get_user(user.pk).is_staff)
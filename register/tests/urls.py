@@ -0,0 +1,6 @@
+from django.conf.urls import patterns, url, include
+
+urlpatterns = patterns('',
+    url(r'^', include("register.urls")),
+    url(r'^register/', include("register.urls", namespace="register")),
+)
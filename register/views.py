@@ -4,13 +4,11 @@ from django.core.urlresolvers import reverse_lazy, reverse
 from django.views.generic import View
 from django.views.generic.base import TemplateView, RedirectView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView, FormView
-from django.contrib.auth import get_user_model
 from .forms import EmailUserForm, ActivateUserForm
 from .models import DEFAULT_KEY
 from .mixins import UserEmailMixin, ActivateMixin
 
 class NewUserView(UserEmailMixin, CreateView):
-    model = get_user_model()
     form_class = EmailUserForm
     template_name = "register/new_user.html"
     success_url = reverse_lazy("activate_user")